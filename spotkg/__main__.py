@@ -1,67 +1,254 @@
 #  Copyright (c) Romir Kulshrestha 2023.
 
 import argparse
+import shutil
 import sys
+import textwrap
 
-from bosdyn.client.util import add_base_arguments, add_service_endpoint_arguments
+VERSION = '0.1.0'
 
-from . import keygene, lidar, qr, recording
-from .globals import ACTIONS
+COMMANDS = {
+    'lidar': 'Run the lidar service.',
+    'record': 'Run the recording service.',
+    'qr': 'Generate QR codes.',
+}
+"""Subcommands and their help text."""
 
-parser = argparse.ArgumentParser(description='Spot Keygene')
-parser.add_argument('--version', action='version', version='%(prog)s 0.1.0')
+OPTIONS = {
+    '--help': ('-h', None, "show this help message and exit"),
+    '--version': (None, None, "show program's version number and exit"),
+}
+"""Top-level options, as long flag -> (short flag, metavar, help text)."""
 
-subparsers = parser.add_subparsers(dest='service')
+QR_OPTIONS = {
+    '--help': ('-h', None, "show this help message and exit"),
+    '--output': (None, 'OUTPUT', "Output directory for the QR codes."),
+    '--zip': (None, None, "Generate a zip file of the QR codes."),
+    '--set': (None, 'KEY=VALUE [KEY=VALUE ...]',
+              "Set a number of id-command pairs "
+              "(do not put spaces before or after the = sign). "
+              "If a value contains spaces, you should define "
+              "it with double quotes: "
+              'foo="this is a sentence". Note that '
+              "values are always treated as strings."),
+}
+"""Options of the qr command, as long flag -> (short flag, metavar, help text)."""
 
-lidar_parser = subparsers.add_parser('lidar', help='Run the lidar service.')
-add_base_arguments(lidar_parser)
-add_service_endpoint_arguments(lidar_parser)
 
-record_parser = subparsers.add_parser('record', help='Run the recording service.')
-add_base_arguments(record_parser)
-record_parser.add_argument('--output', help='Output directory for the recording.', default='.')
+def _usage(prog, options, suffix=''):
+    """Build an argparse-style usage line from an options table."""
+    parts = []
+    for flag, (short, metavar, _) in options.items():
+        parts.append(f"[{short or flag}{' ' + metavar if metavar else ''}]")
+    return f"usage: {prog} {' '.join(parts)}{suffix}\n"
 
-qr_parser = subparsers.add_parser('qr', help='Generate QR codes.')
-qr_parser.add_argument('--output', help='Output directory for the QR codes.', default='./tags')
-qr_parser.add_argument('--zip', help='Generate a zip file of the QR codes.', action='store_true')
-qr_parser.add_argument("--set",
-                       metavar="KEY=VALUE",
-                       nargs='+',
-                       help="Set a number of id-command pairs "
-                            "(do not put spaces before or after the = sign). "
-                            "If a value contains spaces, you should define "
-                            "it with double quotes: "
-                            'foo="this is a sentence". Note that '
-                            "values are always treated as strings.")
 
-default_parser = subparsers.add_parser('<blank>', help='Run the default service.')
+def _format_help(usage, description, sections):
+    """Build argparse-style help text, wrapped to the terminal width."""
+    width = shutil.get_terminal_size().columns - 2
+    lines = [usage, description, '']
+    for title, entries in sections:
+        lines.append(f"{title}:")
+        for name, help_text in entries:
+            if len(name) <= 20:
+                wrapped = textwrap.wrap(help_text, width, initial_indent=f"  {name:<22}", subsequent_indent=' ' * 24)
+            else:
+                wrapped = [f"  {name}"] + textwrap.wrap(help_text, width, initial_indent=' ' * 24,
+                                                        subsequent_indent=' ' * 24)
+            lines.extend(wrapped)
+        lines.append('')
+    return '\n'.join(lines)
 
-options = parser.parse_args()
 
-if options.service == 'lidar':
+def _option_entries(options):
+    return [(', '.join(filter(None, (short, flag))) + (f" {metavar}" if metavar else ''), help_text)
+            for flag, (short, metavar, help_text) in options.items()]
+
+
+def _main_usage():
+    return _usage('spotkg', OPTIONS, f" {{{','.join(COMMANDS)}}} ...")
+
+
+def _main_help():
+    commands = list(COMMANDS.items()) + [('(none)', 'Run the default service.')]
+    return _format_help(_main_usage(), 'Spot Keygene', [('commands', commands), ('options', _option_entries(OPTIONS))])
+
+
+def _qr_usage():
+    return _usage('spotkg qr', QR_OPTIONS)
+
+
+def _qr_help():
+    return _format_help(_qr_usage(), COMMANDS['qr'], [('options', _option_entries(QR_OPTIONS))])
+
+
+def _qr_error(message):
+    sys.stderr.write(_qr_usage())
+    sys.stderr.write(f"spotkg qr: error: {message}\n")
+    sys.exit(2)
+
+
+def _run_lidar(argv):
+    from bosdyn.client.util import add_base_arguments, add_service_endpoint_arguments
+
+    from . import lidar
+
+    parser = argparse.ArgumentParser(prog='spotkg lidar', description=COMMANDS['lidar'])
+    add_base_arguments(parser)
+    add_service_endpoint_arguments(parser)
+    options = parser.parse_args(argv)
+
     print("Starting LiDAR service...")
     lidar.start_lidar(options)
-elif options.service == 'record':
+
+
+def _run_record(argv):
+    from bosdyn.client.util import add_base_arguments
+
+    from . import recording
+
+    parser = argparse.ArgumentParser(prog='spotkg record', description=COMMANDS['record'])
+    add_base_arguments(parser)
+    parser.add_argument('--output', help='Output directory for the recording.', default='.')
+    options = parser.parse_args(argv)
+
     print("Starting recording service...")
     recording.start_recording(options)
-elif options.service == 'qr':
+
+
+def _match_qr_option(name):
+    """Resolve a long option name, accepting unambiguous prefixes like argparse does."""
+    if name in QR_OPTIONS:
+        return name
+    matches = [option for option in QR_OPTIONS if option.startswith(name)]
+    if len(matches) > 1:
+        _qr_error(f"ambiguous option: {name} could match {', '.join(matches)}")
+    return matches[0] if matches else None
+
+
+def _parse_qr_args(argv):
+    """
+    Parse the arguments of the qr command.
+
+    qr only takes three flags, so they are parsed by hand instead of going through argparse.
+    Returns the output directory, whether to zip the codes, and the KEY=VALUE pairs given to --set.
+    """
+    output = './tags'
+    make_zip = False
+    pairs = []
+
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        i += 1
+        if arg == '-h':
+            arg = '--help'
+        if not arg.startswith('--') or arg == '--':
+            _qr_error(f"unrecognized arguments: {' '.join(argv[i - 1:])}")
+
+        name, sep, explicit = arg.partition('=')
+        option = _match_qr_option(name)
+        if option is None:
+            _qr_error(f"unrecognized arguments: {arg}")
+
+        if option in ('--help', '--zip'):
+            if sep:
+                _qr_error(f"argument {option}: ignored explicit argument '{explicit}'")
+            if option == '--help':
+                sys.stdout.write(_qr_help())
+                sys.exit(0)
+            make_zip = True
+        elif option == '--output':
+            if sep:
+                output = explicit
+            elif i < len(argv) and not argv[i].startswith('-'):
+                output = argv[i]
+                i += 1
+            else:
+                _qr_error("argument --output: expected one argument")
+        else:
+            if sep:
+                pairs = [explicit]
+                continue
+            # like argparse's nargs='+', stop at the next option-like token
+            start = i
+            while i < len(argv) and not argv[i].startswith('-'):
+                i += 1
+            if i == start:
+                _qr_error("argument --set: expected at least one argument")
+            pairs = argv[start:i]
+
+    return output, make_zip, pairs
+
+
+def _run_qr(argv):
+    output, make_zip, pairs = _parse_qr_args(argv)
+
+    from . import qr
+    from .globals import ACTIONS
+
     print("Generating QR codes...")
-    if options.set:
-        tags = {}
-        for item in options.set:
-            items = item.split('=')
-            key = int(items[0])
-            if len(items) < 2:
+    if pairs:
+        split_pairs = [item.partition('=') for item in pairs]
+        for _, sep, value in split_pairs:
+            if not sep or not value:
                 raise argparse.ArgumentTypeError('You must provide a value for each key.')
-            value = '='.join(items[1:])
-            if value == "":
-                raise argparse.ArgumentTypeError('You must provide a value for each key.')
-            tags[key] = value
+        tags = {int(key): value for key, _, value in split_pairs}
     else:
         tags = {i: ACTIONS[i % len(ACTIONS)] for i in range(3 * len(ACTIONS))}
 
-    qr.gen_tags(options.output, tags, options.zip)
+    qr.gen_tags(output, tags, make_zip)
     sys.exit(0)
-else:
+
+
+def _run_default(argv):
+    if argv:
+        sys.stderr.write(_main_usage())
+        sys.stderr.write(f"spotkg: error: unrecognized arguments: {' '.join(argv)}\n")
+        sys.exit(2)
+
+    from . import keygene
+
     print("Starting...")
     keygene.run_many(["hjgfhfhgf"])
+
+
+def _print_help(argv):
+    sys.stdout.write(_main_help())
+    sys.exit(0)
+
+
+def _print_version(argv):
+    print(f"spotkg {VERSION}")
+    sys.exit(0)
+
+
+def _invalid_command(command):
+    choices = ', '.join(f"'{name}'" for name in COMMANDS)
+    sys.stderr.write(_main_usage())
+    sys.stderr.write(f"spotkg: error: invalid choice: '{command}' (choose from {choices})\n")
+    sys.exit(2)
+
+
+DISPATCH = {
+    '-h': _print_help,
+    '--help': _print_help,
+    '--version': _print_version,
+    'lidar': _run_lidar,
+    'record': _run_record,
+    'qr': _run_qr,
+    None: _run_default,
+    '<blank>': _run_default,
+}
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    handler = DISPATCH.get(command)
+    if handler is None:
+        _invalid_command(command)
+    handler(sys.argv[2:])
+
+
+if __name__ == '__main__':
+    main()
@@ -8,9 +8,12 @@ methods.
 
 from __future__ import annotations
 
+import mmap
+import operator
 import os
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Callable, Dict, List, Tuple
 
 import bosdyn
@@ -19,13 +22,12 @@ import bosdyn.api.spot.robot_command_pb2 as spot_command_pb2
 import bosdyn.client
 import cv2
 import numpy as np
-from bosdyn.api import image_pb2, world_object_pb2
+from bosdyn.api import image_pb2, robot_command_pb2, world_object_pb2
 from bosdyn.api.autowalk import walks_pb2
 from bosdyn.api.docking import docking_pb2
 from bosdyn.api.graph_nav import graph_nav_pb2, map_pb2, nav_pb2
 from bosdyn.api.mission import mission_pb2
 from bosdyn.client import ResponseError, RpcError, create_standard_sdk
-from bosdyn.client.async_tasks import AsyncTasks
 from bosdyn.client.autowalk import AutowalkClient
 from bosdyn.client.docking import DockingClient, blocking_dock_robot, blocking_undock, get_dock_id
 from bosdyn.client.estop import EstopClient
@@ -39,12 +41,66 @@ from bosdyn.client.robot_state import RobotStateClient
 from bosdyn.client.util import authenticate, setup_logging
 from bosdyn.client.world_object import WorldObjectClient
 from bosdyn.mission.client import MissionClient
+from google.protobuf.internal import api_implementation
 
 from .exceptions import AutowalkStartError, NoMissionRunningException
 from .globals import NAV_VELOCITY_LIMITS, VELOCITY_BASE_ANGULAR, VELOCITY_BASE_SPEED, VELOCITY_CMD_DURATION
-from .tasks import AsyncImage, AsyncRobotState, update_tasks
+from .tasks import (IMAGE_PERIOD, ROBOT_STATE_PERIOD, UPDATE_INTERVAL, AsyncImage, AsyncRobotState,
+                    start_update_loop, stop_update_loop)
 from .util import get_img_source_list
 
+_qr_executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+"""Worker pool for decoding camera images; OpenCV releases the GIL while decoding."""
+SNAPSHOT_UPLOAD_WORKERS = 8
+"""Number of threads used to load and upload graph snapshots."""
+IMAGE_SAVE_WORKERS = 4
+"""Number of threads used to write images to the disk."""
+
+_get_tag_id = operator.attrgetter("apriltag_properties.tag_id")
+
+# commands without parameters are built once; robot_command() copies them into its request, so they can be shared.
+_SELF_RIGHT_CMD = RobotCommandBuilder.selfright_command()
+_SIT_CMD = RobotCommandBuilder.synchro_sit_command()
+_STAND_CMD = RobotCommandBuilder.synchro_stand_command()
+_STOP_CMD = RobotCommandBuilder.stop_command()
+_STOW_CMD = RobotCommandBuilder.arm_stow_command()
+_READY_CMD = RobotCommandBuilder.arm_ready_command()
+
+_VELOCITY_CMD_TEMPLATE = RobotCommandBuilder.synchro_velocity_command(v_x=0.0, v_y=0.0, v_rot=0.0)
+"""Pre-built velocity command; copied and filled in for each velocity command sent."""
+
+
+def _parse_from_file(message, filename):
+    """Parse a protobuf message from a file, handing protobuf a memory map instead of a copy in a bytes object."""
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return message
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            message.ParseFromString(mm)
+    return message
+
+
+def _write_file(filename, data):
+    """Write raw bytes to a file, bypassing Python's buffered file objects."""
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+
+def _velocity_command(v_x, v_y, v_rot):
+    """Build a synchro velocity command from the template, setting only the velocity fields."""
+    command = robot_command_pb2.RobotCommand()
+    command.CopyFrom(_VELOCITY_CMD_TEMPLATE)
+    velocity = command.synchronized_command.mobility_command.se2_velocity_request.velocity
+    velocity.linear.x = v_x
+    velocity.linear.y = v_y
+    velocity.angular = v_rot
+    return command
+
 
 class SpotClient:
     """
@@ -76,6 +132,9 @@ class SpotClient:
         self.logger = self.robot.logger
         self.logger.info("Starting up")
 
+        if api_implementation.Type() == "python":
+            self.logger.warning("Using the pure-Python protobuf backend; graph uploads will be slow.")
+
         authenticate(self.robot)
         self.logger.info("Authentication OK")
 
@@ -98,14 +157,16 @@ class SpotClient:
 
         self.robot_state_task = AsyncRobotState(self.robot_state_client)
         self.image_task = AsyncImage(self.img_client, get_img_source_list(self.img_client))
-        async_tasks = AsyncTasks([self.robot_state_task, self.image_task] + async_tasks)
-        update_thread = threading.Thread(target=update_tasks, daemon=True, args=[async_tasks])
         self.logger.info("Starting async thread...")
-        update_thread.start()
+        self.update_loop = start_update_loop([(self.robot_state_task, ROBOT_STATE_PERIOD),
+                                              (self.image_task, IMAGE_PERIOD)]
+                                             + [(task, UPDATE_INTERVAL) for task in async_tasks])
 
         self.estop_keep_alive = None
         self.exit_check = None
         self.lease_keep_alive = None
+        self._qr_local = threading.local()
+        self._mission_state_cache: Tuple[float, mission_pb2.State] | None = None
 
         self.graph_nav_client.clear_graph()
 
@@ -131,10 +192,19 @@ class SpotClient:
         """Get latest images."""
         return self.image_task.proto
 
+    @property
+    def qr_detector(self) -> cv2.QRCodeDetector:
+        """Get a QR code detector for the calling thread, created on first use."""
+        # QRCodeDetector is not documented as thread-safe, so each thread gets its own.
+        detector = getattr(self._qr_local, "detector", None)
+        if detector is None:
+            detector = self._qr_local.detector = cv2.QRCodeDetector()
+        return detector
+
     @property
     def mission_status(self):
         """Get mission status."""
-        return self.mission_client.get_state().status
+        return self._get_mission_state().status
 
     @property
     def is_docked(self) -> bool:
@@ -193,6 +263,10 @@ class SpotClient:
             self.power_off()
             self.release()
 
+        if getattr(self, "update_loop", None) is not None:
+            self.logger.info("Stopping async tasks...")
+            stop_update_loop(self.update_loop)
+
         self.logger.info("Stopping time sync...")
         self.robot.time_sync.stop()
         self.logger.info("Time sync stopped")
@@ -289,13 +363,13 @@ class SpotClient:
 
     def self_right(self):
         """Self right robot."""
-        self._start_robot_command('self_right', RobotCommandBuilder.selfright_command())
+        self._start_robot_command('self_right', _SELF_RIGHT_CMD)
 
     def sit(self):
-        self._start_robot_command('sit', RobotCommandBuilder.synchro_sit_command())
+        self._start_robot_command('sit', _SIT_CMD)
 
     def stand(self):
-        self._start_robot_command('stand', RobotCommandBuilder.synchro_stand_command())
+        self._start_robot_command('stand', _STAND_CMD)
 
     def move_forward(self):
         self._velocity_cmd_helper('move_forward', v_x=VELOCITY_BASE_SPEED)
@@ -316,23 +390,23 @@ class SpotClient:
         self._velocity_cmd_helper('turn_right', v_rot=-VELOCITY_BASE_ANGULAR)
 
     def stop(self):
-        self._start_robot_command('stop', RobotCommandBuilder.stop_command())
+        self._start_robot_command('stop', _STOP_CMD)
 
     def _velocity_cmd_helper(self, desc='', v_x=0.0, v_y=0.0, v_rot=0.0):
         self._start_robot_command(
-            desc, RobotCommandBuilder.synchro_velocity_command(v_x=v_x, v_y=v_y, v_rot=v_rot),
+            desc, _velocity_command(v_x, v_y, v_rot),
             end_time_secs=time.time() + VELOCITY_CMD_DURATION)
 
     def cmd_vel(self, linear, angular):
         self._start_robot_command(
-            'cmd_vel', RobotCommandBuilder.synchro_velocity_command(linear, 0, angular),
+            'cmd_vel', _velocity_command(linear, 0.0, angular),
             end_time_secs=time.time() + VELOCITY_CMD_DURATION)
 
     def stow(self):
-        self._start_robot_command('stow', RobotCommandBuilder.arm_stow_command())
+        self._start_robot_command('stow', _STOW_CMD)
 
     def unstow(self):
-        self._start_robot_command('stow', RobotCommandBuilder.arm_ready_command())
+        self._start_robot_command('stow', _READY_CMD)
 
     def return_to_origin(self):
         """Return to origin."""
@@ -347,22 +421,30 @@ class SpotClient:
     def get_visible_fiducials(self):
         """Return fiducials visible to robot."""
         request_fiducials = [world_object_pb2.WORLD_OBJECT_APRILTAG]
-        return {obj.apriltag_properties.tag_id for obj in
-                self.world_object_client.list_world_objects(object_type=request_fiducials).world_objects}
+        response = self.world_object_client.list_world_objects(object_type=request_fiducials)
+        # only AprilTags are requested, so every object has apriltag_properties
+        return set(map(_get_tag_id, response.world_objects))
+
+    def _decode_qr_image(self, image_response):
+        """Decode a single visual image response and look for a QR code in it."""
+        # the detector works on grayscale, so decode straight to a single channel
+        buffer = image_response.shot.image.data
+        img = cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8, count=len(buffer)), cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            return None, None
+        data, bbox, _ = self.qr_detector.detectAndDecode(img)
+        return data, bbox
 
     def get_qr_tags(self):
         """Return QR tags visible to robot."""
-        detector = cv2.QRCodeDetector()
+        visual = [image_response for image_response in self.images
+                  if image_response.source.image_type == image_pb2.ImageSource.IMAGE_TYPE_VISUAL]
+        futures = [_qr_executor.submit(self._decode_qr_image, image_response) for image_response in visual]
+
         tags: List[Tuple[str, np.ndarray]] = []
-        for image_response in self.images:
-            if not image_response.source.image_type == image_pb2.ImageSource.IMAGE_TYPE_VISUAL:
-                continue
-            img = cv2.imdecode(np.frombuffer(image_response.shot.image.data, dtype=np.uint8),
-                               cv2.IMREAD_UNCHANGED).reshape(image_response.shot.image.rows,
-                                                             image_response.shot.image.cols,
-                                                             -1)
+        for future in futures:
             try:
-                data, bbox, _ = detector.detectAndDecode(img)
+                data, bbox = future.result()
             except Exception as err:
                 self.logger.error(f"Could not decode QR code: {err}")
                 continue
@@ -373,9 +455,12 @@ class SpotClient:
     def save_images(self, path: str):
         """Save images to disk."""
         os.makedirs(path, exist_ok=True)
-        for i, image_response in enumerate(self.images):
-            with open(f"{path}/image_{i}.jpg", "wb") as f:
-                f.write(image_response.shot.image.data)
+        # image data is already JPEG encoded, so it is written out as-is
+        images = self.images
+        filenames = [os.path.join(path, f"image_{i}.jpg") for i in range(len(images))]
+        with ThreadPoolExecutor(max_workers=IMAGE_SAVE_WORKERS) as executor:
+            list(executor.map(_write_file, filenames,
+                              [image_response.shot.image.data for image_response in images]))
 
     # pose
 
@@ -385,73 +470,59 @@ class SpotClient:
                                   end_time_secs=time.time() + duration)
 
     # autowalk
+    def _upload_waypoint_snapshot(self, snapshot_filename):
+        """Loads a waypoint snapshot from the disk and uploads it to the robot."""
+        self.logger.info(f"Loading waypoint snapshot from {snapshot_filename}")
+        waypoint_snapshot = _parse_from_file(map_pb2.WaypointSnapshot(), snapshot_filename)
+        self.graph_nav_client.upload_waypoint_snapshot(waypoint_snapshot)
+        self.logger.info(f"Uploaded waypoint snapshot {waypoint_snapshot.id}.")
+
+    def _upload_edge_snapshot(self, snapshot_filename):
+        """Loads an edge snapshot from the disk and uploads it to the robot."""
+        self.logger.info(f"Loading edge snapshot from {snapshot_filename}")
+        edge_snapshot = _parse_from_file(map_pb2.EdgeSnapshot(), snapshot_filename)
+        self.graph_nav_client.upload_edge_snapshot(edge_snapshot)
+        self.logger.info(f"Uploaded edge snapshot {edge_snapshot.id}.")
+
     def _upload_graph_and_snapshots(self, path, disable_alternate_route_finding=False, timeout=60):
         """Uploads the graph and snapshots to the robot."""
         # load the graph from the disk
         graph_filename = os.path.join(path, 'graph')
         self.logger.info(f"Loading graph from {graph_filename}")
 
-        with open(graph_filename, 'rb') as graph_file:
-            current_graph = map_pb2.Graph()
-            current_graph.ParseFromString(graph_file.read())
-            self.logger.info(
-                f"Loaded graph with {len(current_graph.waypoints)} waypoints and {len(current_graph.edges)} edges")
+        # parsed once; mutated in place below if needed
+        current_graph = _parse_from_file(map_pb2.Graph(), graph_filename)
+        self.logger.info(
+            f"Loaded graph with {len(current_graph.waypoints)} waypoints and {len(current_graph.edges)} edges")
 
         if disable_alternate_route_finding:
             self.logger.info("Disabling alternate route finding")
             for edge in current_graph.edges:
                 edge.annotations.disable_alternate_route_finding = True
 
-        # load waypoints from the disk
-        current_waypoint_snapshots = dict()
-        for waypoint in current_graph.waypoints:
-            if len(waypoint.snapshot_id) == 0:
-                continue
-            snapshot_filename = os.path.join(path, "waypoint_snapshots", waypoint.snapshot_id)
-            self.logger.info(f"Loading waypoint snapshot from {snapshot_filename}")
-
-            with open(snapshot_filename, 'rb') as snapshot_file:
-                waypoint_snapshot = map_pb2.WaypointSnapshot()
-                waypoint_snapshot.ParseFromString(snapshot_file.read())
-                current_waypoint_snapshots[waypoint_snapshot.id] = waypoint_snapshot
-
-        # load edges from the disk
-        current_edge_snapshots = dict()
-        for edge in current_graph.edges:
-            if len(edge.snapshot_id) == 0:
-                continue
-            snapshot_filename = os.path.join(path, "edge_snapshots", edge.snapshot_id)
-            self.logger.info(f"Loading edge snapshot from {snapshot_filename}")
-
-            with open(snapshot_filename, 'rb') as snapshot_file:
-                edge_snapshot = map_pb2.EdgeSnapshot()
-                edge_snapshot.ParseFromString(snapshot_file.read())
-                current_edge_snapshots[edge_snapshot.id] = edge_snapshot
-
-        # upload the graph and snapshots to the robot
-        self.logger.info("Uploading graph and snapshots to the robot...")
-        anchors_are_empty = not len(current_graph.anchoring.anchors)
+        # upload the graph to the robot
+        self.logger.info("Uploading graph to the robot...")
+        anchors_are_empty = not current_graph.anchoring.anchors
         response = self.graph_nav_client.upload_graph(graph=current_graph, generate_new_anchoring=anchors_are_empty,
                                                       timeout=timeout)
         self.logger.info(f"Uploaded graph.")
 
-        for snapshot_id in response.unknown_waypoint_snapshot_ids:
-            waypoint_snapshot = current_waypoint_snapshots[snapshot_id]
-            self.graph_nav_client.upload_waypoint_snapshot(waypoint_snapshot)
-            self.logger.info(f"Uploaded waypoint snapshot {snapshot_id}.")
-
-        for snapshot_id in response.unknown_edge_snapshot_ids:
-            edge_snapshot = current_edge_snapshots[snapshot_id]
-            self.graph_nav_client.upload_edge_snapshot(edge_snapshot)
-            self.logger.info(f"Uploaded edge snapshot {snapshot_id}.")
+        # only load and upload the snapshots the robot does not have yet, one at a time per worker
+        waypoint_dir = os.path.join(path, "waypoint_snapshots", "")
+        edge_dir = os.path.join(path, "edge_snapshots", "")
+        waypoint_filenames = [waypoint_dir + snapshot_id
+                              for snapshot_id in response.unknown_waypoint_snapshot_ids if snapshot_id]
+        edge_filenames = [edge_dir + snapshot_id for snapshot_id in response.unknown_edge_snapshot_ids if snapshot_id]
+        with ThreadPoolExecutor(max_workers=SNAPSHOT_UPLOAD_WORKERS) as executor:
+            # consume the iterators so that worker exceptions are raised here
+            list(executor.map(self._upload_waypoint_snapshot, waypoint_filenames))
+            list(executor.map(self._upload_edge_snapshot, edge_filenames))
 
     def _upload_autowalk(self, filename, timeout=60):
         """Uploads the autowalk to the robot."""
         self.logger.info(f"Loading autowalk from {filename}")
 
-        autowalk = walks_pb2.Walk()
-        with open(filename, 'rb') as autowalk_file:
-            autowalk.ParseFromString(autowalk_file.read())
+        autowalk = _parse_from_file(walks_pb2.Walk(), filename)
 
         self.logger.info(f"Uploading autowalk to the robot...")
         self.autowalk_client.load_autowalk(autowalk, timeout=timeout)
@@ -462,6 +533,15 @@ class SpotClient:
         self._upload_graph_and_snapshots(path, disable_alternate_route_finding, timeout)
         self._upload_autowalk(os.path.join(path, 'missions/autogenerated.walk'), timeout)
 
+    def _get_mission_state(self, max_age=0.05) -> mission_pb2.State:
+        """Get the mission state, reusing the last response if it is less than `max_age` seconds old."""
+        now = time.monotonic()
+        if self._mission_state_cache is not None and now - self._mission_state_cache[0] < max_age:
+            return self._mission_state_cache[1]
+        mission_state = self.mission_client.get_state()
+        self._mission_state_cache = (now, mission_state)
+        return mission_state
+
     def start_autowalk(self, timeout=60, disable_directed_exploration=False,
                        path_following_mode=map_pb2.Edge.Annotations.PATH_MODE_UNKNOWN, do_localize=False):
         """Starts the autowalk."""
@@ -479,11 +559,16 @@ class SpotClient:
                 max_yaw=None,
                 fiducial_init=graph_nav_pb2.SetLocalizationRequest.FIDUCIAL_INIT_NEAREST)
 
-        mission_state: mission_pb2.State = self.mission_client.get_state()
+        mission_state: mission_pb2.State = self._get_mission_state()
         self.logger.info(f"Mission status: {mission_state.Status.Name(mission_state.status)}")
 
         if mission_state.mission_id == -1:  # If no mission is loaded
             raise AutowalkStartError("No mission is loaded. Please upload a mission first.")
+
+        play_settings = mission_pb2.PlaySettings(disable_directed_exploration=disable_directed_exploration,
+                                                 path_following_mode=path_following_mode,
+                                                 velocity_limit=NAV_VELOCITY_LIMITS)
+
         while mission_state.status in (mission_pb2.State.STATUS_NONE, mission_pb2.State.STATUS_PAUSED):
             self.logger.info("Waiting for mission to start...")
             if mission_state.questions:
@@ -491,15 +576,12 @@ class SpotClient:
                 return False
 
             local_pause_time = time.time() + timeout
-
-            play_settings = mission_pb2.PlaySettings(disable_directed_exploration=disable_directed_exploration,
-                                                     path_following_mode=path_following_mode,
-                                                     velocity_limit=NAV_VELOCITY_LIMITS)
             lease = self.lease_client.lease_wallet.advance()
             self.mission_client.play_mission(local_pause_time, [lease], play_settings)
+            self._mission_state_cache = None
             time.sleep(1)
 
-            mission_state = self.mission_client.get_state()
+            mission_state = self._get_mission_state()
             self.logger.info(f"Mission status: {mission_state.Status.Name(mission_state.status)}")
             if mission_state.status in (mission_pb2.State.STATUS_ERROR, mission_pb2.State.STATUS_FAILURE):
                 raise AutowalkStartError(f"error starting autowalk: {mission_state.error}")
@@ -508,30 +590,32 @@ class SpotClient:
 
     def stop_autowalk(self):
         """Stops the autowalk."""
-        mission_state: mission_pb2.State = self.mission_client.get_state()
+        mission_state: mission_pb2.State = self._get_mission_state()
         if mission_state.status not in (mission_pb2.State.STATUS_RUNNING, mission_pb2.State.STATUS_PAUSED):
             raise NoMissionRunningException(f"Mission status: {mission_state.Status.Name(mission_state.status)}")
 
         self.logger.info("Stopping autowalk...")
         self.mission_client.stop_mission()
+        self._mission_state_cache = None
         time.sleep(1)
 
-        mission_state = self.mission_client.get_state()
+        mission_state = self._get_mission_state()
         self.logger.info(f"Mission status: {mission_state.Status.Name(mission_state.status)}")
 
         return mission_state.status in (mission_pb2.State.STATUS_SUCCESS, mission_pb2.State.STATUS_STOPPED)
 
     def pause_autowalk(self):
         """Pauses the autowalk."""
-        mission_state: mission_pb2.State = self.mission_client.get_state()
+        mission_state: mission_pb2.State = self._get_mission_state()
         if mission_state.status != mission_pb2.State.STATUS_RUNNING:
             raise NoMissionRunningException(f"Mission status: {mission_state.Status.Name(mission_state.status)}")
 
         self.logger.info("Pausing autowalk...")
         self.mission_client.pause_mission()
+        self._mission_state_cache = None
         time.sleep(1)
 
-        mission_state = self.mission_client.get_state()
+        mission_state = self._get_mission_state()
         self.logger.info(f"Mission status: {mission_state.Status.Name(mission_state.status)}")
 
         return mission_state.status == mission_pb2.State.STATUS_PAUSED
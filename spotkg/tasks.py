@@ -1,26 +1,87 @@
 #  Copyright (c) Romir Kulshrestha 2023.
 
+import asyncio
 import logging
-import time
+import threading
+from collections import defaultdict
+from typing import Dict, List, Tuple
 
-from bosdyn.client.async_tasks import AsyncPeriodicQuery, AsyncTasks
+from bosdyn.client.async_tasks import AsyncGRPCTask, AsyncPeriodicQuery
 from bosdyn.client.robot_state import RobotStateClient
 
 UPDATE_INTERVAL = 0.1  # s
+"""Default update interval for async tasks."""
+ROBOT_STATE_PERIOD = 0.2  # s
+"""How often the robot state is queried."""
+IMAGE_PERIOD = 0.067  # s
+"""How often images are queried, about 15 FPS."""
 
+_LOGGER = logging.getLogger(__name__)
 
-def update_tasks(async_tasks: AsyncTasks):
-    """Update all async tasks."""
+
+async def _periodic(tasks: List[AsyncGRPCTask], interval: float):
+    """Update a group of async tasks every `interval` seconds."""
+    failing = set()
     while True:
-        async_tasks.update()
-        time.sleep(UPDATE_INTERVAL)
+        for task in tasks:
+            name = type(task).__name__
+            try:
+                task.update()
+            except Exception:
+                # keep the loop alive so that the task is retried on the next tick, but only log the first failure
+                # of a streak so that a lost connection does not flood the log
+                if task not in failing:
+                    failing.add(task)
+                    _LOGGER.error(f"Failed to update {name}, retrying until it recovers", exc_info=True)
+            else:
+                if task in failing:
+                    failing.discard(task)
+                    _LOGGER.info(f"{name} recovered")
+        await asyncio.sleep(interval)
+
+
+def start_update_loop(async_tasks: List[Tuple[AsyncGRPCTask, float]]) -> asyncio.AbstractEventLoop:
+    """
+    Update async tasks from an event loop running in a daemon thread.
+
+    Takes `(task, interval)` pairs; tasks sharing an interval are updated together, so the loop wakes up once per
+    distinct interval rather than once per task. Use `stop_update_loop` to stop it.
+    """
+    groups: Dict[float, List[AsyncGRPCTask]] = defaultdict(list)
+    for task, interval in async_tasks:
+        groups[interval].append(task)
+
+    loop = asyncio.new_event_loop()
+    for interval, tasks in groups.items():
+        loop.create_task(_periodic(tasks, interval))
+
+    def run():
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_forever()
+        finally:
+            pending = asyncio.all_tasks(loop)
+            for coroutine_task in pending:
+                coroutine_task.cancel()
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            loop.close()
+
+    threading.Thread(target=run, daemon=True).start()
+    return loop
+
+
+def stop_update_loop(loop: asyncio.AbstractEventLoop):
+    """Stop an update loop started with `start_update_loop`. Does nothing if it has already stopped."""
+    if loop.is_closed():
+        return
+    loop.call_soon_threadsafe(loop.stop)
 
 
 class AsyncRobotState(AsyncPeriodicQuery):
     """Grab robot state."""
 
     def __init__(self, robot_state_client: RobotStateClient, logger=logging.getLogger(__name__)):
-        super().__init__("robot_state", robot_state_client, logger, period_sec=0.2)
+        super().__init__("robot_state", robot_state_client, logger, period_sec=ROBOT_STATE_PERIOD)
 
     def _start_query(self):
         return self._client.get_robot_state_async()
@@ -30,8 +91,7 @@ class AsyncImage(AsyncPeriodicQuery):
     """Grab image."""
 
     def __init__(self, image_client, image_sources, logger=logging.getLogger(__name__)):
-        # Period is set to be about 15 FPS
-        super(AsyncImage, self).__init__('images', image_client, logger, period_sec=0.067)
+        super(AsyncImage, self).__init__('images', image_client, logger, period_sec=IMAGE_PERIOD)
         self.image_sources = image_sources
 
     def _start_query(self):
@@ -0,0 +1,92 @@
+#  Copyright (c) Romir Kulshrestha 2023.
+#  You may use, distribute and modify this code under the terms of the MIT License.
+#  You should have received a copy of the MIT License with this file. If not, please visit:
+#  https://opensource.org/licenses/MIT
+
+import pytest
+
+from spotkg.__main__ import DISPATCH, QR_OPTIONS, _parse_qr_args, _run_default, main
+
+
+def test_qr_defaults():
+    assert _parse_qr_args([]) == ('./tags', False, [])
+
+
+def test_qr_options():
+    assert _parse_qr_args(['--output', 'out', '--zip', '--set', '1=a', '2=b=c']) == ('out', True, ['1=a', '2=b=c'])
+
+
+def test_qr_explicit_arguments():
+    assert _parse_qr_args(['--output=out', '--set=1=a']) == ('out', False, ['1=a'])
+
+
+def test_qr_abbreviations():
+    assert _parse_qr_args(['--out', 'out', '--z', '--s', '1=a']) == ('out', True, ['1=a'])
+
+
+def test_qr_set_stops_at_options():
+    assert _parse_qr_args(['--set', '1=a', '2=b', '--zip']) == ('./tags', True, ['1=a', '2=b'])
+
+
+@pytest.mark.parametrize('argv', [['--set', '1=a', '-h'], ['--set', '1=a', '--help'], ['--he']])
+def test_qr_help(argv, capsys):
+    with pytest.raises(SystemExit) as exc:
+        _parse_qr_args(argv)
+    assert exc.value.code == 0
+    assert capsys.readouterr().out.startswith('usage: spotkg qr')
+
+
+@pytest.mark.parametrize('argv', [
+    ['--output'],
+    ['--output', '--zip'],
+    ['--set'],
+    ['--set', '--zip'],
+    ['--set=1=a', '2=b'],
+    ['--zip=yes'],
+    ['--bogus'],
+    ['stray'],
+])
+def test_qr_errors(argv, capsys):
+    with pytest.raises(SystemExit) as exc:
+        _parse_qr_args(argv)
+    assert exc.value.code == 2
+    assert 'spotkg qr: error:' in capsys.readouterr().err
+
+
+def test_qr_help_lists_every_option(capsys):
+    with pytest.raises(SystemExit):
+        _parse_qr_args(['--help'])
+    out = capsys.readouterr().out
+    for flag in QR_OPTIONS:
+        assert flag in out
+
+
+def test_default_rejects_arguments(capsys):
+    with pytest.raises(SystemExit) as exc:
+        _run_default(['junk'])
+    assert exc.value.code == 2
+    assert 'unrecognized arguments: junk' in capsys.readouterr().err
+
+
+def test_main_invalid_command(monkeypatch, capsys):
+    monkeypatch.setattr('sys.argv', ['spotkg', 'x'])
+    with pytest.raises(SystemExit) as exc:
+        main()
+    assert exc.value.code == 2
+    assert "invalid choice: 'x'" in capsys.readouterr().err
+
+
+def test_main_version(monkeypatch, capsys):
+    monkeypatch.setattr('sys.argv', ['spotkg', '--version'])
+    with pytest.raises(SystemExit) as exc:
+        main()
+    assert exc.value.code == 0
+    assert capsys.readouterr().out.startswith('spotkg ')
+
+
+def test_main_runs_default_without_arguments(monkeypatch):
+    calls = []
+    monkeypatch.setitem(DISPATCH, None, calls.append)
+    monkeypatch.setattr('sys.argv', ['spotkg'])
+    main()
+    assert calls == [[]]